@@ -2,10 +2,25 @@ import streamlit as st
 import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import Request
+from google.auth.exceptions import TransportError
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from datetime import datetime, timedelta, time
 import plotly.graph_objects as go
-import uuid
+from secrets import token_hex
+import sqlite3
+from contextlib import closing
+import io
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+import json
+import threading
+from pathlib import Path
+from time import sleep
 import plotly.express as px
+import process_state
 
 # --- 1. PAGE CONFIGURATION ---
 st.set_page_config(
@@ -16,145 +31,439 @@ st.set_page_config(
 )
 
 # --- 2. CSS OVERRIDES (FORCE UNIFORMITY) ---
-st.markdown("""
-    <style>
-    /* 1. GLOBAL BACKGROUND & TEXT */
-    .stApp {
-        background-color: #F4F6F8; /* Light Grey Background */
-        color: #654321; /* Dark Brown Text */
-        font-family: 'Inter', sans-serif;
-    }
-
-    /* 2. FORCE ALL INPUTS TO BE WHITE WITH BLACK TEXT */
-    /* This targets Text Inputs, Number Inputs, Date Pickers */
-    input {
-        background-color: #FFFFFF !important;
-        color: #000000 !important; 
-    }
-    
-    /* This targets Selectboxes, Multiselects, and Time Pickers */
-    div[data-baseweb="select"] > div, 
-    div[data-baseweb="base-input"], 
-    div[data-baseweb="input"] {
-        background-color: #FFFFFF !important;
-        color: #000000 !important;
-        border-color: #E0E0E0 !important;
-    }
-    
-    /* Force text inside the dropdowns to be black */
-    div[data-baseweb="select"] span {
-        color: #000000 !important;
-    }
-    
-    /* Fix the 'X' and arrow icons in dropdowns */
-    div[data-baseweb="select"] svg {
-        fill: #555555 !important;
-    }
-
-    /* 3. LABELS */
-    .stMarkdown label, .stSelectbox label, .stTextInput label, .stDateInput label, .stTimeInput label, .stNumberInput label, .stMultiSelect label {
-        color: #12784A !important;
-        font-weight: 700 !important;
-        font-size: 1rem !important;
-    }
-
-    /* 4. BUTTONS */
-    .stButton > button {
-        background-color: #888888 !important;
-        color: #FFFFFF !important;
-        border: none !important;
-        font-weight: bold;
-    }
-    
-    /* 5. REMOVE WEIRD SPACING AT TOP */
-    .block-container {
-        padding-top: 2rem;
-        padding-bottom: 2rem;
-    }
-            
-    /* 6. TAB STYLING (Add this to your CSS) */
-    button[data-baseweb="tab"] {
-        color: #000000 !important; /* Unselected Text Color */
-        font-weight: 600 !important;
-    }
-    
-    /* Selected Tab (Text & Underline) */
-    button[data-baseweb="tab"][aria-selected="true"] {
-        color: #0000FF !important;       /* Blue Text */
-        border-bottom-color: #12784A !important; /* Green Underline */
-        background-color: transparent !important;
-    }
-    </style>
-""", unsafe_allow_html=True)
+# Kept in styles.css and read from disk once per process
+@st.cache_data
+def _css():
+    return Path(__file__).with_name("styles.css").read_text(encoding="utf-8")
+
+# Streamlit drops any element not re-emitted on a rerun, so the style block is sent every run
+st.markdown(f"<style>{_css()}</style>", unsafe_allow_html=True)
 
 # --- 3. DATABASE CONNECTION ---
 @st.cache_resource
-def get_connection():
+def get_credentials():
     try:
         if "gcp_service_account" not in st.secrets:
             return None
         creds_dict = st.secrets["gcp_service_account"]
         scopes = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
         creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-        client = gspread.authorize(creds)
-        return client
+        _start_token_refresher(creds)
+        return creds
     except Exception as e:
         st.error(f"DB Connection Error: {e}")
         return None
 
+# A 5xx or a dropped answer to an append may still have added the rows; only a 429 is sure
+# to have been rejected, so that is the one POST failure worth sending again
+class WriteRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST" and status_code != 429: return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+def _authorize(creds, retry, timeout):
+    client = gspread.authorize(creds)
+    client.http_client.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    # Without a timeout a stalled socket would hang the caller for good
+    client.http_client.set_timeout(timeout)
+    return client
+
+# Reads run on the render thread: one quick retry, then load_data falls back to the mirror
+@st.cache_resource
+def get_connection():
+    creds = get_credentials()
+    if not creds: return None
+    return _authorize(creds, Retry(total=1, backoff_factor=0.5, respect_retry_after_header=False, raise_on_status=False,
+                                   status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"]), timeout=10)
+
+# The background writer can wait out quota (429) and transient 5xx answers, honouring Retry-After
+@st.cache_resource
+def get_write_connection():
+    creds = get_credentials()
+    if not creds: return None
+    return _authorize(creds, WriteRetry(total=6, read=0, backoff_factor=1.0, respect_retry_after_header=True,
+                                        raise_on_status=False, status_forcelist=[429, 500, 502, 503, 504],
+                                        allowed_methods=["GET", "POST", "PUT"]), timeout=30)
+
+# Tokens live 60 min; refreshing every 45 min in the background keeps
+# requests from stopping for the OAuth exchange. One refresher per process.
+def _start_token_refresher(creds):
+    with process_state.refresher_lock:
+        process_state.credentials = creds
+        if process_state.refresher is None:
+            process_state.refresher = threading.Thread(target=_keep_token_fresh, daemon=True)
+            process_state.refresher.start()
+
+def _keep_token_fresh():
+    while True:
+        try: process_state.credentials.refresh(Request())
+        except Exception: pass  # the session still refreshes on demand if this fails
+        sleep(45 * 60)
+
+# Authorize up front, as the CSS reaches the browser, rather than inside the first data call
+get_connection()
+
 SHEET_ID = '1eUi8Neog9mXb5J17G3WTvCehtR0Bz3-mKkw49gG8tAE'
+COLUMNS = ["Table", "Customer Name", "Start", "End", "Status", "ID", "Notes", "Pax"]
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+TABLE_LIST = tuple(f"Table {i}" for i in range(1, 9)) + ("Outdoor", "VIP")
+STATUSES = ["Reserved", "Cancelled"]
+DB_PATH = Path(__file__).with_name("reservations.db")
+CACHE_TTL = 60  # seconds before edits made directly in the sheet show up in the app
+EXPORT_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export"
+
+# The worksheet handle costs a metadata request to open, so it is kept like the client
+@st.cache_resource
+def get_sheet():
+    client = get_connection()
+    if not client: return None
+    return client.open_by_key(SHEET_ID).sheet1
+
+@st.cache_resource
+def get_write_sheet():
+    client = get_write_connection()
+    if not client: return None
+    return client.open_by_key(SHEET_ID).sheet1
+
+# Local read mirror of the sheet. Sheets stays the source of record; every write goes to both.
+@st.cache_resource
+def init_db():
+    with closing(sqlite3.connect(DB_PATH)) as conn, conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS reservations (
+            "Table" TEXT, "Customer Name" TEXT, "Start" TEXT, "End" TEXT,
+            "Status" TEXT, "ID" TEXT, "Notes" TEXT, "Pax" TEXT)''')
+        # Every read takes the whole table in rowid order, so an index on Start only slowed sync
+        conn.execute('DROP INDEX IF EXISTS idx_start')
+        # Writes the sheet has not accepted yet, oldest first. AUTOINCREMENT keeps seq rising
+        # even once the table is empty, so its last value tells sync whether anything was written.
+        conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, data TEXT, tries INTEGER DEFAULT 0)''')
+        # Outbox entries the sheet rejected outright; kept for reference instead of blocking the rest
+        conn.execute('''CREATE TABLE IF NOT EXISTS dead_letters (
+            seq INTEGER PRIMARY KEY, kind TEXT, data TEXT, error TEXT)''')
+    return True
+
+# A connection per call: SQLite then isolates the sessions' and the writer's transactions
+# from each other (a reader never sees a half-done sync, a booking never lands inside one)
+def get_db():
+    init_db()
+    return closing(sqlite3.connect(DB_PATH, timeout=30))
 
 # --- 4. DATA FUNCTIONS ---
-def load_data():
+def fetch_sheet_csv(client):
+    # The worksheet bookings are written to, as CSV through the client's authorized session,
+    # parsed by pandas' C reader. Only the eight booking columns; anything staff add to the
+    # right is never downloaded. Blank rows are kept so rowid n stays sheet row n + 1.
+    resp = client.http_client.session.get(EXPORT_URL, params={"format": "csv", "gid": get_sheet().id, "range": "A:H"},
+                                          timeout=client.http_client.timeout)
+    resp.raise_for_status()
+    return pd.read_csv(io.BytesIO(resp.content), dtype=str, keep_default_na=False, skip_blank_lines=False)
+
+def _last_write(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'outbox'").fetchone()
+    return row[0] if row else 0
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def sync_from_sheets():
     client = get_connection()
-    if not client: return pd.DataFrame()
+    if not client: return 0
+    # The sheet does not have the outbox rows yet; replacing the mirror now would drop them.
+    # Raising keeps this run out of the cache, so the refresh happens once the outbox drains.
+    with get_db() as conn:
+        last_write = _last_write(conn)
+        if conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]:
+            raise RuntimeError("Sheets writes still pending")
+    try:
+        df = fetch_sheet_csv(client)
+    except Exception:
+        # Export unavailable (or an empty sheet): fall back to the values API
+        rows = get_sheet().get_values("A:H")
+        df = pd.DataFrame(rows[1:], columns=rows[0]) if rows else pd.DataFrame()
+    # A renamed or moved header cell, or an HTML page served as the export, would otherwise
+    # replace a good mirror with empty columns
+    if list(df.columns[:8]) != COLUMNS:
+        raise ValueError(f"Unexpected sheet header: {list(df.columns[:8])}")
+    df = df[COLUMNS]
+    # Keep the sheet's row order: rowid n is sheet row n + 1, which _update_sheet_status relies on.
+    # Delete and refill in one transaction so no reader or writer sees the table in between.
+    with get_db() as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # Something was written while the sheet was downloading: the copy may predate it
+        if _last_write(conn) != last_write:
+            raise RuntimeError("Mirror changed during sync")
+        conn.execute("DELETE FROM reservations")
+        conn.executemany("INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+    return len(df)
+
+def parse_datetimes(values):
+    parsed = pd.to_datetime(values, format=DATETIME_FORMAT, errors='coerce', cache=True)
+    # Cells typed by hand in the sheet may not follow the app's format
+    retry = parsed.isna() & values.fillna('').astype(str).ne('')
+    if retry.any(): parsed[retry] = pd.to_datetime(values[retry], errors='coerce')
+    return parsed
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_data():
+    try: sync_from_sheets()
+    except: pass  # Sheets unreachable or writes pending: serve the last mirrored copy
     try:
-        sheet = client.open_by_key(SHEET_ID).sheet1
-        data = sheet.get_all_records()
-        df = pd.DataFrame(data)
-        expected_cols = ["Table", "Customer Name", "Start", "End", "Status", "ID", "Notes", "Pax"]
-        for col in expected_cols:
-            if col not in df.columns: df[col] = None
+        with get_db() as conn:
+            df = pd.read_sql("SELECT * FROM reservations ORDER BY rowid", conn)
+        # Free-text columns as Arrow strings rather than one Python object per cell
+        df = df.astype({"Customer Name": "string[pyarrow]", "ID": "string[pyarrow]", "Notes": "string[pyarrow]"})
         if not df.empty:
-            df['Start'] = pd.to_datetime(df['Start'], errors='coerce')
-            df['End'] = pd.to_datetime(df['End'], errors='coerce')
-        return df
-    except: return pd.DataFrame()
+            df['Start'] = parse_datetimes(df['Start'])
+            df['End'] = parse_datetimes(df['End'])
+            df['StartDate'] = df['Start'].dt.normalize()
+            # Few distinct values: store as int codes so Status/Table masks are integer compares
+            df['Status'] = df['Status'].astype('category')
+            df['Status'] = df['Status'].cat.add_categories([s for s in STATUSES if s not in df['Status'].cat.categories])
+            df['Table'] = df['Table'].astype('category')
+        # One row per booked table for the timeline; the unexploded frame stays unique by ID
+        df_tables = df.assign(Table=df['Table'].str.split(', ')).explode('Table').reset_index(drop=True) if not df.empty else df
+        return df, df_tables
+    except: return pd.DataFrame(), pd.DataFrame()
 
-def add_reservation(payload):
-    client = get_connection()
-    sheet = client.open_by_key(SHEET_ID).sheet1
-    if not sheet.row_values(1):
-        sheet.append_row(["Table", "Customer Name", "Start", "End", "Status", "ID", "Notes", "Pax"])
-    
-    table_str = ", ".join(payload["Table"])
-    sheet.append_row([
-        table_str, payload["Customer Name"], str(payload["Start"]), 
-        str(payload["End"]), payload["Status"], payload["ID"], 
+# Sorted once per data refresh; a tuple so the options are not rebuilt on every keystroke
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_customer_list():
+    df, _ = load_data()
+    if df.empty: return ()
+    names = df["Customer Name"].dropna()
+    return tuple(sorted(names[names != ""].unique()))
+
+def add_reservation(payloads):
+    # Accepts one booking or a list of them; all rows go out in the same append_rows call
+    if isinstance(payloads, dict): payloads = [payloads]
+    rows = [[
+        ", ".join(payload["Table"]), payload["Customer Name"], payload["Start"].strftime(DATETIME_FORMAT), 
+        payload["End"].strftime(DATETIME_FORMAT), payload["Status"], payload["ID"], 
         payload["Notes"], payload["Pax"]
-    ])
+    ] for payload in payloads]
+    # Mirror and outbox in one transaction: a booking is never in one without the other
+    with get_db() as conn, conn:
+        conn.executemany("INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT INTO outbox (kind, data) VALUES ('append', ?)", (json.dumps(rows),))
+    return schedule_flush()
 
 def update_status_batch(changes_dict):
-    client = get_connection()
-    sheet = client.open_by_key(SHEET_ID).sheet1
-    id_list = sheet.col_values(6)
-    updates = []
-    for row_id, new_status in changes_dict.items():
-        try:
-            row_num = id_list.index(row_id) + 1
-            updates.append({'range': f'E{row_num}', 'values': [[new_status]]})
-        except: continue
-    if updates: sheet.batch_update(updates)
-
-# --- 5. MAIN UI ---
-st.title("🍽️ Vert Reservation Manager")
+    with get_db() as conn, conn:
+        conn.executemany('UPDATE reservations SET "Status" = ? WHERE "ID" = ?',
+                         [(status, rid) for rid, status in changes_dict.items()])
+        conn.execute("INSERT INTO outbox (kind, data) VALUES ('status', ?)", (json.dumps(changes_dict),))
+    return schedule_flush()
 
-tab1, tab2 = st.tabs(["📝 NEW BOOKING", "📊 SCHEDULE GRID"])
+# Sheets writes run off the render thread; the local mirror is already updated when they start
+@st.cache_resource
+def get_executor():
+    # A single worker keeps writes in submission order, so a status edit never overtakes its booking
+    return ThreadPoolExecutor(max_workers=1)
+
+# Most recent flush submitted by any session, so reruns only retry the outbox when it is idle
+@st.cache_resource
+def get_flush_state():
+    return {"future": None}
+
+def schedule_flush():
+    state = get_flush_state()
+    state["future"] = get_executor().submit(_flush_outbox)
+    return state["future"]
+
+def outbox_size():
+    with get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+# The header only has to be checked once per process, not on every booking
+@st.cache_resource
+def ensure_header(_sheet):
+    if not _sheet.row_values(1):
+        _sheet.append_row(COLUMNS)
+    return True
+
+# Quota, server and network failures clear up on their own; any other error would fail the same way again
+def _is_retryable(exc):
+    if isinstance(exc, gspread.exceptions.APIError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, (requests.exceptions.RequestException, TransportError))
+
+def _flush_outbox():
+    # Whichever flush runs first sends everything queued so far. An entry leaves the outbox
+    # once the sheet has accepted it, or as a dead letter once the sheet has rejected it;
+    # retryable failures leave it in place for the next flush.
+    sheet = get_write_sheet()
+    if not sheet: return
+    with process_state.flush_lock:
+        _send_outbox(sheet)
+
+def _send_outbox(sheet):
+    while True:
+        with get_db() as conn:
+            entries = conn.execute("SELECT seq, kind, data, tries FROM outbox ORDER BY seq").fetchall()
+        if not entries: return
+        # Consecutive bookings go out in one append_rows call; each status edit on its own,
+        # so one that lands is not sent again if a later one fails
+        batches = []
+        for kind, group in groupby(entries, key=lambda entry: entry[1]):
+            batches += [list(group)] if kind == "append" else [[entry] for entry in group]
+        for batch in batches:
+            try:
+                if batch[0][1] == "append":
+                    _append_batch(sheet, batch)
+                else:
+                    _update_sheet_status(sheet, json.loads(batch[0][2]))
+            except Exception as e:
+                if _is_retryable(e): raise
+                with get_db() as conn, conn:
+                    conn.executemany("INSERT INTO dead_letters VALUES (?, ?, ?, ?)",
+                                     [(*entry[:3], repr(e)) for entry in batch])
+                    conn.executemany("DELETE FROM outbox WHERE seq = ?", [(entry[0],) for entry in batch])
+                continue
+            with get_db() as conn, conn:
+                conn.executemany("DELETE FROM outbox WHERE seq = ?", [(entry[0],) for entry in batch])
+
+def _append_batch(sheet, batch):
+    rows = [row for entry in batch for row in json.loads(entry[2])]
+    # A failed attempt may still have added the rows (a 5xx or a lost answer), so a re-send
+    # first drops the rows whose IDs are already in the sheet
+    if any(entry[3] for entry in batch):
+        in_sheet = set(sheet.col_values(6))
+        rows = [row for row in rows if row[5] not in in_sheet]
+    with get_db() as conn, conn:
+        conn.executemany("UPDATE outbox SET tries = tries + 1 WHERE seq = ?", [(entry[0],) for entry in batch])
+    ensure_header(sheet)
+    if rows: sheet.append_rows(rows, value_input_option='RAW')
+
+def _status_ranges(changes_dict, id_to_row):
+    # Consecutive rows share one E{first}:E{last} range instead of one range per cell
+    row_status = {id_to_row[rid]: status for rid, status in changes_dict.items() if rid in id_to_row}
+    runs = []
+    for row_num in sorted(row_status):
+        if runs and row_num == runs[-1][-1] + 1: runs[-1].append(row_num)
+        else: runs.append([row_num])
+    return [{'range': f'E{run[0]}:E{run[-1]}', 'values': [[row_status[r]] for r in run]} for run in runs]
+
+def _update_sheet_status(sheet, changes_dict):
+    # Row numbers come from the mirror (rowid n is sheet row n + 1), read only now that
+    # every earlier outbox entry has reached the sheet
+    with get_db() as conn:
+        id_to_row = dict(conn.execute('SELECT "ID", rowid + 1 FROM reservations').fetchall())
+    ids = list(changes_dict)
+    # Rows deleted, inserted or sorted by hand since the last sync would shift the mirror's
+    # numbers, so check the ID column at those rows before writing and look up live otherwise
+    found = []
+    if any(rid in id_to_row for rid in ids):
+        cells = sheet.batch_get([f'F{id_to_row[rid]}' for rid in ids if rid in id_to_row])
+        found = [cell[0][0] if cell and cell[0] else "" for cell in cells]
+    if found != ids:
+        id_to_row = {rid: i + 1 for i, rid in enumerate(sheet.col_values(6))}
+    updates = _status_ranges(changes_dict, id_to_row)
+    if updates: sheet.batch_update(updates, value_input_option='RAW')
+
+# --- 5. CHART ---
+# Bounded: every data refresh and viewed date adds an entry
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_timeline(df_plot, view_date):
+    # Define the full range
+    start_view = datetime.combine(view_date, time(10, 0))
+    end_view = datetime.combine(view_date, time(22, 0))
+
+    # ---- FORCE ALL TABLES TO APPEAR ----
+    # Create invisible dummy rows for each table
+    dummy_df = pd.DataFrame({
+        "Table": list(TABLE_LIST),
+        "Start": [start_view] * len(TABLE_LIST),
+        "End": [start_view] * len(TABLE_LIST),
+        "Customer Name": [""] * len(TABLE_LIST),
+        "Pax": [None] * len(TABLE_LIST)
+    })
+
+    # Combine real + dummy
+    plot_df = pd.concat([dummy_df, df_plot], ignore_index=True)
+
+    fig = px.timeline(
+        plot_df,
+        x_start="Start",
+        x_end="End",
+        y="Table",
+        hover_name="Customer Name",
+        hover_data={
+            "Pax": True,
+            "Start": "|%H:%M",
+            "End": "|%H:%M",
+            "Table": False
+        },
+        color_discrete_sequence=["#12784A"]
+    )
+
+    # Hide dummy bars (zero-length)
+    fig.update_traces(
+        selector=dict(x_end=start_view),
+        visible=False
+    )
+
+    # UNIFIED LAYOUT (Ensures consistency whether empty or full)
+    fig.update_layout(
+        xaxis_range=[start_view, end_view],
+        xaxis=dict(
+            title="Time",
+            tickformat="%H:%M",
+            dtick=1800000, # 30 mins
+            gridcolor="#EEEEEE",
+            showgrid=True,
+            tickfont=dict(color="black", size=12),
+            range=[start_view, end_view]
+        ),
+        yaxis=dict(
+            title="",
+            categoryorder="array",
+            categoryarray=TABLE_LIST, # This keeps the list visible even if empty
+            gridcolor="#EEEEEE",
+            showgrid=True,
+            tickfont=dict(color="black", size=14, family="Arial Black")
+        ),
+        plot_bgcolor="white",
+        paper_bgcolor="#F4F6F8",
+        height=600,
+        margin=dict(l=150, r=20, t=40, b=50)
+    )
+    
+    fig.update_traces(marker_line_color="white", marker_line_width=2, opacity=0.9)
+    return fig
+
+# --- 6. VIEWS ---
+# Each tab is a fragment, so interacting with one reruns only that tab. Fragment reruns
+# reuse their arguments, so each one reads the cached data and checks the writer itself.
+
+def report_writes():
+    # Report Sheets writes queued on earlier reruns that have since finished
+    pending_writes = st.session_state.setdefault("pending_writes", [])
+    for future in [f for f in pending_writes if f.done()]:
+        pending_writes.remove(future)
+        if future.exception():
+            st.warning(f"Google Sheets could not be updated yet, the change is queued and will be retried: {future.exception()}")
+
+    # Changes the sheet rejected are not retried; tell each session about them once
+    with get_db() as conn:
+        rejected = conn.execute("SELECT seq, kind, error FROM dead_letters WHERE seq > ? ORDER BY seq",
+                                (st.session_state.get("dead_letters_seen", 0),)).fetchall()
+    if rejected:
+        st.session_state["dead_letters_seen"] = rejected[-1][0]
+        st.error(f"Google Sheets rejected {len(rejected)} change(s); re-enter them or fix the sheet: "
+                 + "; ".join(f"{kind}: {error}" for _, kind, error in rejected))
+
+    # Writes left in the outbox by a failed flush or a restart go out again on the next rerun
+    flush = get_flush_state()["future"]
+    if (flush is None or flush.done()) and outbox_size():
+        schedule_flush()
 
 # ==========================================
 # TAB 1: FORM (Clean Layout)
 # ==========================================
-with tab1:
+@st.fragment
+def render_form():
+    report_writes()
+    df_all, _ = load_data()
     # We use a container to visually group, but we don't try to wrap it in HTML div anymore
     with st.container():
         st.subheader("📅 Date & Time")
@@ -169,12 +478,9 @@ with tab1:
     with st.form("res_form", clear_on_submit=True):
         st.subheader("👤 Guest Information")
         
-        df_cached = load_data()
-        prev_customers = sorted(df_cached["Customer Name"].dropna().unique().tolist()) if not df_cached.empty else []
-
         c1, c2 = st.columns(2)
         with c1:
-            cust_select = st.selectbox("Search Existing Customer", [""] + prev_customers)
+            cust_select = st.selectbox("Search Existing Customer", ("",) + get_customer_list())
         with c2:
             cust_new = st.text_input("Or Enter New Name")
         
@@ -191,8 +497,7 @@ with tab1:
         with c5:
             duration = st.selectbox("Duration", [1, 2, 3, 4], index=1, format_func=lambda x: f"{x} Hours")
         with c6:
-            table_list = [f"Table {i}" for i in range(1, 9)] + ["Outdoor", "VIP"]
-            tables = st.multiselect("Assign Table(s)", table_list)
+            tables = st.multiselect("Assign Table(s)", TABLE_LIST)
 
         st.markdown("<br>", unsafe_allow_html=True)
         st.subheader("📝 Notes")
@@ -209,115 +514,67 @@ with tab1:
             else:
                 with st.spinner("Processing..."):
                     start_dt = datetime.combine(res_date, res_time)
+                    # 8 hex chars collide at roughly 65k rows, so re-draw on a clash
+                    taken_ids = set(df_all['ID']) if not df_all.empty else set()
+                    res_id = token_hex(4)
+                    while res_id in taken_ids: res_id = token_hex(4)
                     end_dt = start_dt + timedelta(hours=duration)
                     payload = {
                         "Table": tables,
                         "Customer Name": final_cust,
                         "Start": start_dt, "End": end_dt, "Status": "Reserved",
-                        "ID": str(uuid.uuid4())[:8], "Notes": notes, "Pax": pax
+                        "ID": res_id, "Notes": notes, "Pax": pax
                     }
-                    add_reservation(payload)
-                    st.toast("Reservation Created!", icon="🎉")
-                    st.cache_resource.clear()
+                    st.session_state["pending_writes"].append(add_reservation(payload))
+                    st.session_state["flash"] = "Reservation Created!"
+                    load_data.clear()
+                    get_customer_list.clear()
+                # Full rerun so the schedule fragment picks up the new booking too
+                st.rerun()
 
 # ==========================================
 # TAB 2: PRECISION GRID VISUAL (ALWAYS VISIBLE)
 # ==========================================
-with tab2:
+@st.fragment
+def render_dashboard():
+    report_writes()
+    df_all, df_tables = load_data()
     col_f1, _ = st.columns([1, 4])
     with col_f1:
         view_date = st.date_input("📅 View Schedule For", datetime.now(), key="view_date")
         
-    df = load_data()
+    df = df_all
     
     # 1. Filter data for the selected day
-    mask = (df['Start'].dt.date == view_date) & (df['Status'] != 'Cancelled') if not df.empty else []
-    df_plot = df.loc[mask].copy() if not df.empty else pd.DataFrame()
+    mask = (df_tables['StartDate'] == pd.Timestamp(view_date)) & (df_tables['Status'] != 'Cancelled') if not df_tables.empty else []
+    df_plot = df_tables.loc[mask].copy() if not df_tables.empty else pd.DataFrame()
 
-    # 2. Define the full range and Table list
-    start_view = datetime.combine(view_date, time(10, 0))
-    end_view = datetime.combine(view_date, time(22, 0))
-    all_tables = [f"Table {i}" for i in range(1, 9)] + ["Outdoor", "VIP"]
-
-    # Handle multiple tables in one booking
-    if not df_plot.empty:
-        df_plot = df_plot.assign(Table=df_plot['Table'].str.split(', ')).explode('Table')
-
-    # ---- FORCE ALL TABLES TO APPEAR ----
-    # Create invisible dummy rows for each table
-    dummy_df = pd.DataFrame({
-        "Table": all_tables,
-        "Start": [start_view] * len(all_tables),
-        "End": [start_view] * len(all_tables),
-        "Customer Name": [""] * len(all_tables),
-        "Pax": [None] * len(all_tables)
-    })
-
-    # Combine real + dummy
-    plot_df = pd.concat([dummy_df, df_plot], ignore_index=True)
-
-    fig = px.timeline(
-        plot_df,
-        x_start="Start",
-        x_end="End",
-        y="Table",
-        hover_name="Customer Name",
-        hover_data={
-            "Pax": True,
-            "Start": "|%H:%M",
-            "End": "|%H:%M",
-            "Table": False
-        },
-        color_discrete_sequence=["#12784A"]
-    )
-
-    # Hide dummy bars (zero-length)
-    fig.update_traces(
-        selector=dict(x_end=start_view),
-        visible=False
-    )
-
-
-    # 3. UNIFIED LAYOUT (Ensures consistency whether empty or full)
-    fig.update_layout(
-        xaxis_range=[start_view, end_view],
-        xaxis=dict(
-            title="Time",
-            tickformat="%H:%M",
-            dtick=1800000, # 30 mins
-            gridcolor="#EEEEEE",
-            showgrid=True,
-            tickfont=dict(color="black", size=12),
-            range=[start_view, end_view]
-        ),
-        yaxis=dict(
-            title="",
-            categoryorder="array",
-            categoryarray=all_tables, # This keeps the list visible even if empty
-            gridcolor="#EEEEEE",
-            showgrid=True,
-            tickfont=dict(color="black", size=14, family="Arial Black")
-        ),
-        plot_bgcolor="white",
-        paper_bgcolor="#F4F6F8",
-        height=600,
-        margin=dict(l=150, r=20, t=40, b=50)
-    )
-    
-    fig.update_traces(marker_line_color="white", marker_line_width=2, opacity=0.9)
+    fig = build_timeline(df_plot, view_date)
     st.plotly_chart(fig, use_container_width=True)
 
     st.markdown("---")
     st.subheader("📋 Status Reservation")
     
     if not df.empty:
-        mask_all = (df['Start'].dt.date == view_date)
-        df_all = df.loc[mask_all].copy().sort_values("Start")
+        mask_all = (df['StartDate'] == pd.Timestamp(view_date))
+        df_day = df.loc[mask_all].copy()
+        # Bookings are usually appended in time order already; stable sort keeps ties in entry order
+        if not df_day['Start'].is_monotonic_increasing:
+            df_day = df_day.sort_values("Start", kind="mergesort")
+
+        # Only one page of rows goes to the browser; the save diff covers that page only
+        c_size, c_page, _ = st.columns([1, 1, 3])
+        with c_size:
+            page_size = st.selectbox("Rows per page", [20, 50, 100])
+        n_pages = max(1, -(-len(df_day) // page_size))
+        with c_page:
+            page = st.number_input("Page", min_value=1, max_value=n_pages, value=1)
+        df_page = df_day.iloc[(page - 1) * page_size : page * page_size]
         
         edited_df = st.data_editor(
-            df_all[["Status", "Table", "Customer Name", "Start", "End", "Notes", "ID"]],
+            df_page[["Status", "Table", "Customer Name", "Start", "End", "Notes", "ID"]],
             column_config={
-                "Status": st.column_config.SelectboxColumn("Status", options=["Reserved", "Cancelled"], required=True),
+                "Status": st.column_config.SelectboxColumn("Status", options=STATUSES, required=True),
                 "Start": st.column_config.DatetimeColumn("Start", format="HH:mm"),
                 "End": st.column_config.DatetimeColumn("End", format="HH:mm"),
                 "ID": st.column_config.TextColumn("ID", disabled=True),
@@ -327,13 +584,27 @@ with tab2:
         )
 
         if st.button("💾 SAVE CHANGES"):
-            changes = {}
-            for i, row in edited_df.iterrows():
-                orig = df.loc[df['ID'] == row['ID'], 'Status'].values[0]
-                if row['Status'] != orig: changes[row['ID']] = row['Status']
+            orig = df.drop_duplicates('ID').set_index('ID')['Status'].astype(object)
+            new = edited_df.set_index('ID')['Status'].astype(object)
+            changes = new[new != orig.reindex(new.index)].to_dict()
             if changes:
-                update_status_batch(changes)
+                st.session_state["pending_writes"].append(update_status_batch(changes))
                 st.success("Database Updated!")
-                st.cache_resource.clear()
+                load_data.clear()
+                get_customer_list.clear()
 
                 st.rerun()
+
+# --- 7. MAIN UI ---
+st.title("🍽️ Vert Reservation Manager")
+
+if "flash" in st.session_state:
+    st.toast(st.session_state.pop("flash"), icon="🎉")
+
+tab1, tab2 = st.tabs(["📝 NEW BOOKING", "📊 SCHEDULE GRID"])
+
+with tab1:
+    render_form()
+
+with tab2:
+    render_dashboard()
@@ -0,0 +1,13 @@
+# Process-wide objects that must exist exactly once per process. app.py is re-executed on
+# every rerun and "Clear cache" empties st.cache_resource, but an imported module stays put.
+import threading
+
+# Held while the outbox is flushed, so a second executor (e.g. after a cache clear) never
+# sends the same entries again
+flush_lock = threading.Lock()
+
+# Credentials the background refresher keeps fresh; a cache clear swaps in the new ones
+# rather than starting another refresher
+credentials = None
+refresher = None
+refresher_lock = threading.Lock()